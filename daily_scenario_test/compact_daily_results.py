@@ -0,0 +1,31 @@
+import argparse
+
+from daily_test_store import RETENTION_DAYS, compact_daily_results, ensure_indexes
+
+# Fold the daily results older than the retention window into monthly
+# aggregates in the archive collection. Safe to run repeatedly (e.g. daily cron).
+#
+#   MONGODB_URI=... python3 daily_scenario_test/compact_daily_results.py --retention-days 90
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact old daily results")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only print the months that would be compacted",
+    )
+    args = parser.parse_args()
+
+    ensure_indexes()
+    cutoff, compacted = compact_daily_results(
+        retention_days=args.retention_days, dry_run=args.dry_run
+    )
+    for month, days in compacted:
+        print("{}: {} days archived".format(month, days))
+    print("Days before {} are archived ({} months)".format(cutoff, len(compacted)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
 import pandas as pd
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient
 
 # CSVファイルのパス
 csv_file_path = "example_daily_test.csv"
@@ -39,6 +39,7 @@ for index, row in df.iterrows():
 
     # ドキュメント形式でデータを挿入
     document = {
+        "URL": row["URL"],
         "Date": row["Date"],
         "OK": row["シナリオテスト総計：OK"],
         "NG": row["シナリオテスト総計：NG"],
@@ -50,4 +51,8 @@ for index, row in df.iterrows():
     # MongoDBにデータ挿入
     collection.insert_one(document)
 
+# ドリルダウン用のインデックスを作成
+collection.create_index([("Date", ASCENDING)])
+collection.create_index([("Suite.name", ASCENDING), ("Date", ASCENDING)])
+
 print("CSVデータがMongoDBにインポートされました。")
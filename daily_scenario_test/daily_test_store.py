@@ -0,0 +1,404 @@
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# numpy, pandas and pymongo are imported on first use to keep startup fast
+
+MONGO_URI = os.environ.get("MONGODB_URI")
+DB_NAME = "daily_scenario_test_db"
+COLLECTION_NAME = "daily_scenario_test_collection"
+# Monthly aggregates of the days older than RETENTION_DAYS
+ARCHIVE_COLLECTION_NAME = "daily_scenario_test_archive_collection"
+
+# Timeout (ms) of every MongoDB operation issued by the dashboard
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", 5000))
+# Interval (s) between snapshot refreshes
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 5))
+# Number of threads used for drill-down queries
+DRILL_DOWN_WORKERS = int(os.environ.get("DRILL_DOWN_WORKERS", 2))
+# Number of suites / days kept in the drill-down cache
+DRILL_DOWN_CACHE_SIZE = int(os.environ.get("DRILL_DOWN_CACHE_SIZE", 128))
+# Number of days kept with full per-suite detail in the raw collection
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 90))
+
+DATE_FORMAT = "%Y/%m/%d"
+# "Days" is the number of days folded into an archived row (1 for raw days)
+SUMMARY_FIELDS = ["Date", "Days", "OK", "NG", "Total", "Success Rate (%)"]
+COUNT_FIELDS = ["OK", "NG", "Total"]
+DETAIL_FIELDS = ["OK", "NG", "Total", "URL"]
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+# summary: DataFrame of SUMMARY_FIELDS (+ "id" for the DataTable row_id)
+# ng_dates / ng_suite_names / ng_matrix: date x suite NG matrix (NaN if missing)
+# ng_days: number of days behind each cell of ng_matrix (archived cells hold
+# per-day averages over that many days, raw cells 1)
+# version: hash of the data, changes when a day is added, corrected or compacted
+Snapshot = namedtuple(
+    "Snapshot",
+    [
+        "summary",
+        "ng_dates",
+        "ng_suite_names",
+        "ng_matrix",
+        "ng_days",
+        "latest_date",
+        "version",
+        "updated_at",
+    ],
+)
+
+
+def get_collection(name=COLLECTION_NAME):
+    # The client is created (and connects) on first use, not at import time
+    global _client
+    with _client_lock:
+        if _client is None:
+            from pymongo import MongoClient
+
+            _client = MongoClient(
+                MONGO_URI,
+                serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_TIMEOUT_MS,
+            )
+    return _client[DB_NAME][name]
+
+
+@lru_cache(maxsize=None)
+def get_empty_snapshot():
+    import numpy as np
+    import pandas as pd
+
+    return Snapshot(
+        summary=pd.DataFrame(columns=SUMMARY_FIELDS),
+        ng_dates=[],
+        ng_suite_names=[],
+        ng_matrix=np.empty((0, 0)),
+        ng_days=np.empty((0, 0)),
+        latest_date=None,
+        version=None,
+        updated_at=None,
+    )
+
+
+def ensure_indexes():
+    from pymongo import ASCENDING
+
+    # Indexes used by the snapshot and drill-down queries
+    for name in [COLLECTION_NAME, ARCHIVE_COLLECTION_NAME]:
+        collection = get_collection(name)
+        collection.create_index([("Date", ASCENDING)])
+        collection.create_index([("Suite.name", ASCENDING), ("Date", ASCENDING)])
+    # compact_daily_results() upserts one document per month
+    get_collection(ARCHIVE_COLLECTION_NAME).create_index(
+        [("Month", ASCENDING)], unique=True
+    )
+
+
+def find_stitched(query, projection):
+    from pymongo import ASCENDING
+
+    # Archived aggregates are always older than the raw days
+    documents = []
+    for name in [ARCHIVE_COLLECTION_NAME, COLLECTION_NAME]:
+        cursor = get_collection(name).find(query, projection).sort("Date", ASCENDING)
+        documents.extend(cursor)
+    return documents
+
+
+def fetch_snapshot():
+    import numpy as np
+    import pandas as pd
+
+    projection = {"_id": 0, "URL": 1, "Suite.Days": 1, "Suite.CountDays.NG": 1}
+    # every field returned by the drill-downs is part of the version
+    projection.update({"Suite.name": 1, "Suite.OK": 1, "Suite.NG": 1, "Suite.Total": 1})
+    projection.update({field: 1 for field in SUMMARY_FIELDS})
+    documents = find_stitched({}, projection)
+
+    summary = pd.DataFrame(
+        [{field: doc.get(field) for field in SUMMARY_FIELDS} for doc in documents],
+        columns=SUMMARY_FIELDS,
+    )
+    summary["Days"] = summary["Days"].fillna(1)
+    # row_id of the DataTable is used to drill down into a day
+    summary["id"] = summary["Date"]
+
+    # すべてのテスト項目名に列番号を割り当てる
+    suite_index = {}
+    for doc in documents:
+        for suite in doc.get("Suite", []):
+            suite_index.setdefault(suite["name"], len(suite_index))
+
+    # rows: date, columns: suite (NaN if the suite has no NG count on that date)
+    ng_matrix = np.full((len(documents), len(suite_index)), np.nan)
+    ng_days = np.zeros((len(documents), len(suite_index)))
+    for row, doc in enumerate(documents):
+        for suite in doc.get("Suite", []):
+            if suite.get("NG") is not None:
+                column = suite_index[suite["name"]]
+                ng_matrix[row, column] = suite["NG"]
+                # raw days have neither; older archives only have Days
+                days = suite.get("Days", 1)
+                ng_days[row, column] = suite.get("CountDays", {}).get("NG", days)
+
+    data_hash = hashlib.sha1(summary.to_csv(index=False).encode())
+    for doc in documents:
+        details = [doc.get("URL")]
+        for suite in doc.get("Suite", []):
+            details.append([suite["name"]] + [suite.get(key) for key in COUNT_FIELDS])
+        data_hash.update(repr(details).encode())
+
+    ng_dates = summary["Date"].tolist()
+    return Snapshot(
+        summary=summary,
+        ng_dates=ng_dates,
+        ng_suite_names=list(suite_index),
+        ng_matrix=ng_matrix,
+        ng_days=ng_days,
+        latest_date=ng_dates[-1] if ng_dates else None,
+        version=data_hash.hexdigest(),
+        updated_at=time.time(),
+    )
+
+
+def fetch_suite_history(suite_name):
+    import pandas as pd
+
+    documents = find_stitched(
+        {"Suite.name": suite_name}, {"_id": 0, "Date": 1, "URL": 1, "Suite.$": 1}
+    )
+
+    history = []
+    for doc in documents:
+        suite = doc["Suite"][0]
+        row = {"Date": doc["Date"]}
+        row.update({key: suite.get(key) for key in COUNT_FIELDS})
+        row["URL"] = doc.get("URL")
+        history.append(row)
+    return pd.DataFrame(history, columns=["Date"] + DETAIL_FIELDS)
+
+
+def fetch_day_results(date):
+    import pandas as pd
+
+    # Returns (period, results); period describes an archived row as its month
+    projection = {"_id": 0, "URL": 1, "Suite": 1, "Month": 1, "Days": 1}
+    doc = get_collection().find_one({"Date": date}, projection)
+    if doc is None:
+        doc = get_collection(ARCHIVE_COLLECTION_NAME).find_one(
+            {"Date": date}, projection
+        )
+    period = date
+    if doc and "Month" in doc:
+        period = "{} ({} days, per-day average)".format(doc["Month"], doc["Days"])
+
+    results = []
+    for suite in doc["Suite"] if doc else []:
+        row = {"Suite": suite["name"]}
+        row.update({key: suite.get(key) for key in COUNT_FIELDS})
+        row["URL"] = doc.get("URL")
+        results.append(row)
+    return period, pd.DataFrame(results, columns=["Suite"] + DETAIL_FIELDS)
+
+
+def _empty_sums():
+    sums = {"Days": 0, "CountDays": {key: 0 for key in COUNT_FIELDS}}
+    sums.update({key: 0 for key in COUNT_FIELDS})
+    return sums
+
+
+def _fold_counts(sums, counts):
+    # sums: {"Days": n, "CountDays": {key: days with a value}, "OK": ..., ...}
+    sums["Days"] += 1
+    for key in COUNT_FIELDS:
+        if counts.get(key) is not None:
+            sums[key] += counts[key]
+            sums["CountDays"][key] += 1
+
+
+def _unfold_counts(means):
+    # Inverse of _average_counts()
+    sums = _empty_sums()
+    sums["Days"] = means.get("Days", 0)
+    for key in COUNT_FIELDS:
+        # archives written before CountDays existed averaged over all days
+        count_days = means.get("CountDays", {}).get(key, sums["Days"])
+        if means.get(key) is not None:
+            sums[key] = means[key] * count_days
+            sums["CountDays"][key] = count_days
+    return sums
+
+
+def _average_counts(sums):
+    # A key without any value stays None (missing), not 0
+    means = {"Days": sums["Days"], "CountDays": dict(sums["CountDays"])}
+    for key in COUNT_FIELDS:
+        count_days = sums["CountDays"][key]
+        means[key] = sums[key] / count_days if count_days else None
+    return means
+
+
+def _fold_archive(archived, documents):
+    # archived: existing archived aggregate of the month (or None)
+    # Values are stored as per-day averages so that they share the scale of raw days
+    dates = list(archived["Dates"]) if archived else []
+    sums = _unfold_counts(archived or {})
+    suite_sums = OrderedDict()
+    for suite in archived["Suite"] if archived else []:
+        suite_sums[suite["name"]] = _unfold_counts(suite)
+
+    for doc in documents:
+        if doc["Date"] in dates:
+            continue
+        dates.append(doc["Date"])
+        _fold_counts(sums, doc)
+        for suite in doc["Suite"]:
+            suite_sum = suite_sums.setdefault(suite["name"], _empty_sums())
+            _fold_counts(suite_sum, suite)
+
+    means = _average_counts(sums)
+    suites = []
+    for suite_name, suite_sum in suite_sums.items():
+        suite = {"name": suite_name}
+        suite.update(_average_counts(suite_sum))
+        suites.append(suite)
+
+    document = {"Date": min(dates), "Dates": sorted(dates), "Suite": suites}
+    document.update(means)
+    document["Success Rate (%)"] = (
+        means["OK"] / means["Total"] * 100
+        if means["OK"] is not None and means["Total"]
+        else None
+    )
+    return document
+
+
+def compact_daily_results(retention_days=RETENTION_DAYS, today=None, dry_run=False):
+    from pymongo import ASCENDING
+
+    # Fold the days older than retention_days into monthly aggregates
+    today = today or datetime.date.today()
+    cutoff = (today - datetime.timedelta(days=retention_days)).strftime(DATE_FORMAT)
+    collection = get_collection()
+    archive = get_collection(ARCHIVE_COLLECTION_NAME)
+
+    months = OrderedDict()
+    old_documents = collection.find({"Date": {"$lt": cutoff}}, {"_id": 0})
+    for doc in old_documents.sort("Date", ASCENDING):
+        months.setdefault(doc["Date"][:7], []).append(doc)
+
+    compacted = []
+    for month, documents in months.items():
+        archived = archive.find_one({"Month": month}, {"_id": 0})
+        document = _fold_archive(archived, documents)
+        document["Month"] = month
+        dates = [doc["Date"] for doc in documents]
+        if not dry_run:
+            # The archive is written first; Dates keeps a re-run after a crash
+            # idempotent
+            archive.replace_one({"Month": month}, document, upsert=True)
+            collection.delete_many({"Date": {"$in": dates}})
+        compacted.append((month, len(dates)))
+    return cutoff, compacted
+
+
+# Owns all MongoDB I/O of the dashboard: a background thread replaces the
+# snapshot every `interval` seconds and drill-down queries run on a bounded
+# thread pool, so callbacks never wait on the database.
+class SnapshotRefresher:
+    def __init__(
+        self,
+        interval=REFRESH_INTERVAL,
+        max_workers=DRILL_DOWN_WORKERS,
+        cache_size=DRILL_DOWN_CACHE_SIZE,
+    ):
+        self.interval = interval
+        self.cache_size = cache_size
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # key -> Future, in LRU order; running futures coalesce identical requests
+        self._futures = OrderedDict()
+
+    def start(self):
+        with self._lock:
+            # also restarts a thread that died (or did not survive a fork)
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="snapshot-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._executor.shutdown(wait=False)
+
+    def refresh(self):
+        try:
+            snapshot = fetch_snapshot()
+        except Exception:
+            # keep serving the previous snapshot; the thread must not die
+            logger.exception("Failed to refresh the snapshot")
+            return False
+        self._snapshot = snapshot
+        return True
+
+    def _run(self):
+        try:
+            ensure_indexes()
+        except Exception:
+            logger.exception("Failed to create the indexes")
+        while not self._stop_event.is_set():
+            self.refresh()
+            self._stop_event.wait(self.interval)
+
+    def get_snapshot(self):
+        self.start()
+        if self._snapshot is None:
+            return get_empty_snapshot()
+        return self._snapshot
+
+    def _request_key(self, kind, name):
+        # version is part of the key so that new, re-imported or compacted data
+        # is fetched again
+        return (kind, name, self.get_snapshot().version)
+
+    def request(self, kind, name, retry=False):
+        # Starts fetching the drill-down data of a suite or a day and returns its
+        # key. A failed request is kept (not retried on every poll) unless retry.
+        key = self._request_key(kind, name)
+        with self._lock:
+            future = self._futures.get(key)
+            failed = (
+                future is not None and future.done() and future.exception() is not None
+            )
+            if future is not None and not (retry and failed):
+                self._futures.move_to_end(key)
+                return key
+            fetch = fetch_suite_history if kind == "suite" else fetch_day_results
+            self._futures[key] = self._executor.submit(fetch, name)
+            while len(self._futures) > self.cache_size:
+                self._futures.popitem(last=False)
+            return key
+
+    def get_request(self, key):
+        # Future of a key returned by request(), or None if it was evicted
+        with self._lock:
+            return self._futures.get(tuple(key))
+
+
+refresher = SnapshotRefresher()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Measure the time to import a dashboard module (= worker boot time) in a
+# fresh interpreter, so that startup regressions show up.
+#
+#   python3 daily_scenario_test/measure_startup.py --repeat 10 --max-seconds 2.0
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SCRIPT_DIR)
+
+DASHBOARDS = {
+    "mongodb": "plotly_dash_daily_test_mongodb",
+    "csv": "plotly_dash_daily_test",
+}
+
+MEASURE_CODE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def measure_import_time(module):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [SCRIPT_DIR] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE_CODE.format(module=module)],
+        cwd=REPO_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure dashboard startup time")
+    parser.add_argument("--dashboard", choices=DASHBOARDS, default="mongodb")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=None,
+        help="exit with 1 if the median import time exceeds this value",
+    )
+    args = parser.parse_args()
+
+    module = DASHBOARDS[args.dashboard]
+    # the first run warms the bytecode and file system caches
+    measure_import_time(module)
+    times = [measure_import_time(module) for _ in range(args.repeat)]
+
+    median = statistics.median(times)
+    print(
+        "{}: median {:.3f}s, min {:.3f}s, max {:.3f}s ({} runs)".format(
+            module, median, min(times), max(times), args.repeat
+        )
+    )
+    if args.max_seconds is not None and median > args.max_seconds:
+        print("startup time exceeds {:.3f}s".format(args.max_seconds))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
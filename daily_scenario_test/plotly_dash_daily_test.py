@@ -2,6 +2,8 @@ import os
 
 import dash
 from dash import dcc, html, dash_table
+from dash.dependencies import Input, Output
+import numpy as np
 import plotly.graph_objs as go
 import plotly.express as px
 import pandas as pd
@@ -9,6 +11,9 @@ import pandas as pd
 # Read CSV data
 df = pd.read_csv('./daily_scenario_test/example_daily_test.csv')
 
+# Number of suites drawn in the NG line view
+NG_TOP_K = int(os.environ.get('NG_TOP_K', 10))
+
 # Define color theme
 color_theme = {
     'background': 'rgb(6, 30, 68)',
@@ -82,36 +87,70 @@ def create_pie_chart():
     )
     return chart
 
-def create_ng_analysis_plot():
-    fig = go.Figure()
+def get_ng_matrix():
     # Select columns containing 'NG' except for 'シナリオテスト総計：NG'
     ng_columns = [col for col in df.columns if 'NG' in col and col != 'シナリオテスト総計：NG']
+    # rows: date, columns: suite
+    ng_matrix = df[ng_columns].to_numpy(dtype=float)
+    return ng_columns, ng_matrix
 
-    # Add traces to the figure
-    for col in ng_columns:
-        fig.add_trace(go.Scatter(
-            x=df['Date'], y=df[col], mode='lines+markers', name=col
-        ))
+def select_top_k_suites(suite_names, ng_matrix, top_k):
+    # Keep the suites with the largest NG count over the whole history
+    if top_k is None or top_k >= len(suite_names):
+        return suite_names, ng_matrix
+    ng_totals = np.nansum(ng_matrix, axis=0)
+    top_indices = np.argsort(-ng_totals, kind='stable')[:top_k]
+    return [suite_names[i] for i in top_indices], ng_matrix[:, top_indices]
 
-    # Update figure layout
+def update_ng_layout(fig, title):
     fig.update_layout(
-        title='History of NG Scenario Suite',
+        title=title,
         xaxis_title='Date',
-        yaxis_title='Count',
         plot_bgcolor=color_theme['light-background'],
         paper_bgcolor=color_theme['light-background'],
         font_color=color_theme['text'],
         title_font_color=color_theme['text'],
-        legend_title_text='Scenario',
         xaxis=dict(gridcolor=color_theme['grid'], nticks=20),
+    )
+    return fig
+
+def create_ng_analysis_plot(top_k=NG_TOP_K):
+    fig = go.Figure()
+    ng_columns, ng_matrix = get_ng_matrix()
+    ng_columns, ng_matrix = select_top_k_suites(ng_columns, ng_matrix, top_k)
+
+    # Add WebGL traces to the figure
+    for i, col in enumerate(ng_columns):
+        fig.add_trace(go.Scattergl(
+            x=df['Date'], y=ng_matrix[:, i], mode='lines+markers', name=col
+        ))
+
+    # Update figure layout
+    update_ng_layout(fig, 'History of NG Scenario Suite (Top {})'.format(len(ng_columns)))
+    fig.update_layout(
+        yaxis_title='Count',
+        legend_title_text='Scenario',
         yaxis=dict(gridcolor=color_theme['grid'], nticks=20)
     )
     return fig
 
+def create_ng_heatmap_plot():
+    # Encode the whole date x suite NG matrix as a single trace
+    ng_columns, ng_matrix = get_ng_matrix()
+    fig = go.Figure(go.Heatmap(
+        x=df['Date'], y=ng_columns, z=ng_matrix.T,
+        colorscale='Inferno', colorbar=dict(title='NG'),
+        hovertemplate='%{x}<br>%{y}<br>NG: %{z}<extra></extra>'
+    ))
+    update_ng_layout(fig, 'History of NG Scenario Suite')
+    fig.update_layout(yaxis=dict(autorange='reversed'))
+    return fig
+
 # Create plots and chart
 time_series_plot = create_time_series_plot()
 pie_chart = create_pie_chart()
 ng_analysis_plot = create_ng_analysis_plot()
+ng_heatmap_plot = create_ng_heatmap_plot()
 
 # External stylesheet for Open Sans font
 external_stylesheets = ['https://fonts.googleapis.com/css2?family=Open+Sans:wght@400;700&display=swap']
@@ -167,8 +206,20 @@ app.layout = html.Div(
                 ),
                 # -- second layer --
                 html.Div(
-                    dcc.Graph(id='pie-chart2', figure=ng_analysis_plot),
-                    style={'padding': '10px', 'margin-bottom': '30px'}
+                    style={'padding': '10px', 'margin-bottom': '30px'},
+                    children=[
+                        dcc.RadioItems(
+                            id='ng-view',
+                            options=[
+                                {'label': 'Heatmap', 'value': 'heatmap'},
+                                {'label': 'Top {} lines'.format(NG_TOP_K), 'value': 'lines'},
+                            ],
+                            value='heatmap',
+                            inline=True,
+                            style={'marginBottom': '10px'}
+                        ),
+                        dcc.Graph(id='pie-chart2', figure=ng_heatmap_plot),
+                    ]
                 ),
                 # -- third layer --
                 html.Div(
@@ -210,6 +261,13 @@ app.layout = html.Div(
     ]
 )
 
+# switch NG view
+@app.callback(Output('pie-chart2', 'figure'), [Input('ng-view', 'value')])
+def update_ng_view(ng_view):
+    if ng_view == 'lines':
+        return ng_analysis_plot
+    return ng_heatmap_plot
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8050))
     app.run_server(debug=True, host='0.0.0.0', port=port)
@@ -1,18 +1,14 @@
 import os
-from pymongo import MongoClient
-import pandas as pd
 import dash
 from dash import dcc, html, dash_table
 import plotly.graph_objs as go
-import plotly.express as px
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
-MONGO_URI = os.environ.get('MONGODB_URI')
-DB_NAME = "daily_scenario_test_db"
-COLLECTION_NAME = "daily_scenario_test_collection"
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+from daily_test_store import refresher
+
+# Number of suites drawn in the NG line view
+NG_TOP_K = int(os.environ.get("NG_TOP_K", 10))
 
 # Define color theme
 color_theme = {
@@ -27,56 +23,18 @@ color_theme = {
 }
 
 
-def fetch_data():
-    data = list(collection.find())
-    return pd.DataFrame(data)
-
-
-def fetch_and_prepare_data_for_datatable():
-    all_suites = set()  # すべてのSuiteの名前を保存するセット
-    documents = list(collection.find())
-
-    # まずは、存在するすべてのSuiteの名前を収集
-    for doc in documents:
-        for suite in doc["Suite"]:
-            all_suites.add(suite["name"])
+def get_empty_title(snapshot):
+    # The first snapshot is loaded in the background
+    if snapshot.updated_at is None:
+        return "Loading..."
+    return "No data available"
 
-    prepared_data = []
-
-    for doc in documents:
-        row = {
-            "Date": doc["Date"],
-            "OK": doc["OK"],
-            "NG": doc["NG"],
-            "Total": doc["Total"],
-            "Success Rate (%)": doc["Success Rate (%)"],
-        }
-
-        # すべてのSuiteについて、値が存在するか確認し、存在しない場合はNoneを設定
-        for suite_name in all_suites:
-            suite_data = next(
-                (item for item in doc["Suite"] if item["name"] == suite_name), None
-            )
-            for key in ["OK", "NG", "Total"]:
-                if suite_data and key in suite_data:
-                    row[f"{suite_name}_{key}"] = suite_data[key]
-                else:
-                    row[f"{suite_name}_{key}"] = (
-                        None  # 該当するキーがない場合はNoneを設定
-                    )
 
-        prepared_data.append(row)
-
-    # 新しいDataFrameを作成
-    df_prepared = pd.DataFrame(prepared_data)
-    return df_prepared
-
-
-def create_time_series_plot():
-    df = fetch_data()
+def create_time_series_plot(snapshot):
+    df = snapshot.summary
     plot = go.Figure()
     if df.empty:
-        plot.update_layout(title="No data available")
+        plot.update_layout(title=get_empty_title(snapshot))
         return plot
 
     plot.add_trace(
@@ -130,10 +88,13 @@ def create_time_series_plot():
     return plot
 
 
-def create_pie_chart():
-    df = fetch_data()
+def create_pie_chart(snapshot):
+    # plotly.express (and pandas) are only needed here
+    import plotly.express as px
+
+    df = snapshot.summary
     if df.empty:
-        return px.pie(title="No data available")
+        return px.pie(title=get_empty_title(snapshot))
     latest_success_rate = df.iloc[-1]["Success Rate (%)"]
     pie_data = {
         "labels": ["Success Rate", "Failure Rate"],
@@ -158,58 +119,95 @@ def create_pie_chart():
     return chart
 
 
-def create_ng_analysis_plot():
-    df = fetch_data()
+def select_top_k_suites(suite_names, ng_matrix, top_k, days=None):
+    import numpy as np
+
+    # Keep the suites with the largest NG count over the whole history
+    if top_k is None or top_k >= len(suite_names):
+        return suite_names, ng_matrix
+    if days is None:
+        ng_totals = np.nansum(ng_matrix, axis=0)
+    else:
+        # archived cells are per-day averages over `days` days of the suite
+        ng_totals = np.nansum(ng_matrix * days, axis=0)
+    top_indices = np.argsort(-ng_totals, kind="stable")[:top_k]
+    return [suite_names[i] for i in top_indices], ng_matrix[:, top_indices]
+
+
+def update_ng_layout(fig, title):
+    fig.update_layout(
+        title=title,
+        xaxis_title="Date",
+        plot_bgcolor=color_theme["light-background"],
+        paper_bgcolor=color_theme["light-background"],
+        font_color=color_theme["text"],
+        title_font_color=color_theme["text"],
+        xaxis=dict(gridcolor=color_theme["grid"], nticks=20),
+    )
+    return fig
+
+
+def create_ng_analysis_plot(snapshot, top_k=NG_TOP_K):
+    import numpy as np
+
     fig = go.Figure()
-    if df.empty:
+    if not snapshot.ng_dates:
         # データが空の場合は空のプロットを返す
-        fig.update_layout(title="No data available")
+        fig.update_layout(title=get_empty_title(snapshot))
         return fig
 
-    # 'Suite'内の各テスト項目ごとにNGの数を時系列でプロット
-    # すべてのテスト項目名を保存するセット
-    all_suites = set()
-    for index, row in df.iterrows():
-        suites = row["Suite"]  # Suiteは辞書のリストとして格納されていると仮定
-        for suite in suites:
-            all_suites.add(suite["name"])
-
-    # MongoDBのデータ構造に基づいてプロットを追加
-    for suite_name in all_suites:
-        dates = []
-        ng_counts = []
-        for index, row in df.iterrows():
-            suites = row["Suite"]
-            date = row["Date"]
-            ng_count = None
-            for suite in suites:
-                if suite["name"] == suite_name and "NG" in suite:
-                    ng_count = suite["NG"]
-            if ng_count is not None:
-                dates.append(date)  # 日付を追加
-                ng_counts.append(ng_count)
-
-        # NGの数を時系列でプロット
+    suite_names, ng_matrix = select_top_k_suites(
+        snapshot.ng_suite_names, snapshot.ng_matrix, top_k, days=snapshot.ng_days
+    )
+    dates = np.asarray(snapshot.ng_dates)
+
+    # NGの数を時系列でプロット (WebGL)
+    for column, suite_name in enumerate(suite_names):
+        ng_counts = ng_matrix[:, column]
+        has_ng = ~np.isnan(ng_counts)
         fig.add_trace(
-            go.Scatter(x=dates, y=ng_counts, mode="lines+markers", name=suite_name)
+            go.Scattergl(
+                x=dates[has_ng],
+                y=ng_counts[has_ng],
+                mode="lines+markers",
+                name=suite_name,
+            )
         )
 
     # Update figure layout
+    update_ng_layout(
+        fig, "History of NG Scenario Suite (Top {})".format(len(suite_names))
+    )
     fig.update_layout(
-        title="History of NG Scenario Suite",
-        xaxis_title="Date",
         yaxis_title="Count",
-        plot_bgcolor=color_theme["light-background"],
-        paper_bgcolor=color_theme["light-background"],
-        font_color=color_theme["text"],
-        title_font_color=color_theme["text"],
         legend_title_text="Scenario",
-        xaxis=dict(gridcolor=color_theme["grid"], nticks=20),
         yaxis=dict(gridcolor=color_theme["grid"], nticks=20),
     )
     return fig
 
 
+def create_ng_heatmap_plot(snapshot):
+    fig = go.Figure()
+    if not snapshot.ng_dates:
+        fig.update_layout(title=get_empty_title(snapshot))
+        return fig
+
+    # Encode the whole date x suite NG matrix as a single trace
+    fig.add_trace(
+        go.Heatmap(
+            x=snapshot.ng_dates,
+            y=snapshot.ng_suite_names,
+            z=snapshot.ng_matrix.T,
+            colorscale="Inferno",
+            colorbar=dict(title="NG"),
+            hovertemplate="%{x}<br>%{y}<br>NG: %{z}<extra></extra>",
+        )
+    )
+    update_ng_layout(fig, "History of NG Scenario Suite")
+    fig.update_layout(yaxis=dict(autorange="reversed"))
+    return fig
+
+
 # External stylesheet for Open Sans font
 external_stylesheets = [
     "https://fonts.googleapis.com/css2?family=Open+Sans:wght@400;700&display=swap"
@@ -217,22 +215,38 @@ external_stylesheets = [
 # Initialize Dash app with external stylesheet
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
+
+def create_app():
+    # WSGI entry point: gunicorn "plotly_dash_daily_test_mongodb:create_app()"
+    # pre-warm the snapshot while the server starts
+    refresher.start()
+    return app.server
+
+
 # update plots and chart
 @app.callback(
     Output("time-series-plot", "figure"), [Input("update-interval", "n_intervals")]
 )
 def update_time_series_plot(n_intervals):
-    return create_time_series_plot()
+    return create_time_series_plot(refresher.get_snapshot())
 
 
 @app.callback(Output("pie-chart", "figure"), [Input("update-interval", "n_intervals")])
 def update_pie_chart(n_intervals):
-    return create_pie_chart()
+    return create_pie_chart(refresher.get_snapshot())
 
 
-@app.callback(Output("pie-chart2", "figure"), [Input("update-interval", "n_intervals")])
-def update_ng_analysis_plot(n_intervals):
-    return create_ng_analysis_plot()
+@app.callback(
+    [Output("pie-chart2", "figure"), Output("ng-line-suites", "data")],
+    [Input("update-interval", "n_intervals"), Input("ng-view", "value")],
+)
+def update_ng_analysis_plot(n_intervals, ng_view):
+    snapshot = refresher.get_snapshot()
+    if ng_view == "lines":
+        fig = create_ng_analysis_plot(snapshot)
+        # suite of each trace, to resolve clicks by curveNumber
+        return fig, [trace.name for trace in fig.data]
+    return create_ng_heatmap_plot(snapshot), None
 
 
 @app.callback(
@@ -240,12 +254,156 @@ def update_ng_analysis_plot(n_intervals):
     [Input("update-interval", "n_intervals")],
 )
 def update_datatable_columns_and_data(n_intervals):
-    df_prepared = fetch_and_prepare_data_for_datatable()
-    columns = [{"name": i, "id": i} for i in df_prepared.columns]
-    data = df_prepared.to_dict("records")
+    df_summary = refresher.get_snapshot().summary
+    columns = [{"name": i, "id": i} for i in df_summary.columns if i != "id"]
+    data = df_summary.to_dict("records")
     return columns, data
 
 
+def create_detail_table_columns(df_detail):
+    columns = []
+    for i in df_detail.columns:
+        if i == "URL":
+            columns.append({"name": i, "id": i, "presentation": "markdown"})
+        else:
+            columns.append({"name": i, "id": i})
+    return columns
+
+
+def format_url_links(df_detail):
+    df_detail = df_detail.copy()
+    df_detail["URL"] = [
+        "[report]({})".format(url) if isinstance(url, str) else ""
+        for url in df_detail["URL"]
+    ]
+    return df_detail
+
+
+def create_suite_detail_plot(suite_name, df_history):
+    fig = go.Figure()
+    for key, color in [
+        ("Total", "rgb(50, 205, 50)"),
+        ("OK", "#00CED1"),
+        ("NG", "rgb(255, 100, 14)"),
+    ]:
+        fig.add_trace(
+            go.Scatter(
+                x=df_history["Date"],
+                y=df_history[key],
+                mode="lines+markers",
+                name=key,
+                line=dict(color=color),
+            )
+        )
+    update_ng_layout(fig, "History of {}".format(suite_name))
+    fig.update_layout(
+        yaxis_title="Count", yaxis=dict(gridcolor=color_theme["grid"], nticks=20)
+    )
+    return fig
+
+
+def create_day_detail_plot(period, df_results):
+    fig = go.Figure(
+        go.Bar(
+            x=df_results["Suite"],
+            y=df_results["NG"],
+            marker_color="rgb(255, 100, 14)",
+            name="NG",
+        )
+    )
+    update_ng_layout(fig, "NG Scenario Suite: {}".format(period))
+    fig.update_layout(
+        xaxis_title="Suite",
+        yaxis_title="Count",
+        yaxis=dict(gridcolor=color_theme["grid"], nticks=20),
+    )
+    return fig
+
+
+def get_clicked_suite(click_data, line_suites):
+    if not click_data or not click_data.get("points"):
+        return None
+    point = click_data["points"][0]
+    # line view: one trace per suite, heatmap: suite name on the y axis
+    if line_suites is not None:
+        return line_suites[point["curveNumber"]]
+    return point.get("y")
+
+
+def create_message_plot(title):
+    fig = go.Figure()
+    update_ng_layout(fig, title)
+    return fig
+
+
+# select a suite (NG plot click) or a day (table row click) to drill down into
+@app.callback(
+    Output("detail-selection", "data"),
+    [Input("pie-chart2", "clickData"), Input("datatable-container", "active_cell")],
+    [State("ng-line-suites", "data")],
+)
+def update_detail_selection(click_data, active_cell, line_suites):
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+    if "pie-chart2.clickData" in triggered:
+        kind, name = "suite", get_clicked_suite(click_data, line_suites)
+    elif active_cell and active_cell.get("row_id") is not None:
+        kind, name = "day", active_cell["row_id"]
+    else:
+        raise PreventUpdate
+    if name is None:
+        raise PreventUpdate
+
+    # start fetching in the background; clicking again retries a failed request
+    key = refresher.request(kind, name, retry=True)
+    return {"kind": kind, "key": name, "request": list(key)}
+
+
+# render the drill-down once its data is ready (polled until then)
+@app.callback(
+    [
+        Output("detail-container", "style"),
+        Output("detail-plot", "figure"),
+        Output("detail-table", "columns"),
+        Output("detail-table", "data"),
+        Output("detail-interval", "disabled"),
+    ],
+    [Input("detail-selection", "data"), Input("detail-interval", "n_intervals")],
+)
+def update_detail(selection, n_intervals):
+    if not selection:
+        raise PreventUpdate
+
+    future = refresher.get_request(selection["request"])
+    if future is None:
+        # evicted from the cache before it was rendered
+        future = refresher.get_request(
+            refresher.request(selection["kind"], selection["key"])
+        )
+
+    if not future.done():
+        triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+        if "detail-selection.data" not in triggered:
+            # still loading, nothing new to show
+            raise PreventUpdate
+        fig = create_message_plot("Loading {}...".format(selection["key"]))
+        return {"display": "block"}, fig, [], [], False
+    if future.exception() is not None:
+        fig = create_message_plot("Failed to load {}".format(selection["key"]))
+        return {"display": "block"}, fig, [], [], True
+
+    if selection["kind"] == "suite":
+        df_detail = future.result()
+        fig = create_suite_detail_plot(selection["key"], df_detail)
+    else:
+        period, df_detail = future.result()
+        fig = create_day_detail_plot(period, df_detail)
+
+    df_detail = format_url_links(df_detail)
+    columns = create_detail_table_columns(df_detail)
+    # rendered once; polling stops until the selection changes
+    return {"display": "block"}, fig, columns, df_detail.to_dict("records"), True
+
+
 # Layout of the app
 app.layout = html.Div(
     style={
@@ -261,6 +419,10 @@ app.layout = html.Div(
     },
     children=[
         dcc.Interval(id="update-interval", interval=5 * 1000, n_intervals=0),  # 5s
+        dcc.Store(id="detail-selection"),
+        dcc.Store(id="ng-line-suites"),
+        # polls a drill-down request until its data is ready
+        dcc.Interval(id="detail-interval", interval=500, disabled=True),
         html.Div(
             style={"padding": "2rem", "flexGrow": 1},
             children=[
@@ -293,8 +455,23 @@ app.layout = html.Div(
                 ),
                 # -- second layer --
                 html.Div(
-                    dcc.Graph(id="pie-chart2"),  # Updated: figure attribute removed
                     style={"padding": "10px", "margin-bottom": "30px"},
+                    children=[
+                        dcc.RadioItems(
+                            id="ng-view",
+                            options=[
+                                {"label": "Heatmap", "value": "heatmap"},
+                                {
+                                    "label": "Top {} lines".format(NG_TOP_K),
+                                    "value": "lines",
+                                },
+                            ],
+                            value="heatmap",
+                            inline=True,
+                            style={"marginBottom": "10px"},
+                        ),
+                        dcc.Graph(id="pie-chart2"),  # Updated: figure attribute removed
+                    ],
                 ),
                 # -- third layer --
                 html.Div(
@@ -319,6 +496,39 @@ app.layout = html.Div(
                         style_data={"border": "1px solid #183A54"},
                     ),
                 ),
+                # -- drill-down (loaded on click) --
+                html.Div(
+                    id="detail-container",
+                    style={"display": "none"},
+                    children=[
+                        html.Div(
+                            dcc.Graph(id="detail-plot"),
+                            style={"padding": "10px", "margin-bottom": "30px"},
+                        ),
+                        html.Div(
+                            dash_table.DataTable(
+                                id="detail-table",
+                                columns=[],
+                                markdown_options={"link_target": "_blank"},
+                                style_table={
+                                    "overflowX": "auto",
+                                    "maxHeight": "300px",
+                                    "overflowY": "auto",
+                                },
+                                style_cell={
+                                    "backgroundColor": color_theme["light-background"],
+                                    "color": "white",
+                                },
+                                style_header={
+                                    "backgroundColor": color_theme["dark-background"],
+                                    "color": "white",
+                                },
+                                style_data={"border": "1px solid #183A54"},
+                            ),
+                            style={"padding": "10px", "margin-bottom": "30px"},
+                        ),
+                    ],
+                ),
             ],
         ),
     ],
@@ -326,5 +536,9 @@ app.layout = html.Div(
 
 
 if __name__ == "__main__":
+    debug = os.environ.get("DEBUG", "true").lower() == "true"
+    # the werkzeug reloader's parent process only watches files and serves nothing
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        create_app()
     port = int(os.environ.get("PORT", 8050))
-    app.run_server(debug=True, host="0.0.0.0", port=port)
+    app.run_server(debug=debug, host="0.0.0.0", port=port)